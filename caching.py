@@ -0,0 +1,319 @@
+# standard
+import collections
+import contextlib
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import re
+import shutil
+import threading
+import weakref
+# external
+import pandas
+
+# Dataset fingerprint for results keyed only by frame contents, while no dataset is registered
+UNVERSIONED = "unversioned"
+# Bump to invalidate all cached results, e.g. when the pickled result format changes
+CACHE_VERSION = 1
+# Names of the per dataset version directories the cache creates, other directories in cache_dir are left alone
+DATASET_DIRECTORY_PATTERN = re.compile(f"[0-9a-f]{{16}}|{UNVERSIONED}")
+
+
+def fingerprint_dataset(file_id: str, cleaning_schema: (dict | list)) -> str:
+    """
+    Create a fingerprint for a dataset version.
+    A new source file or a change in the cleaning steps gives a new fingerprint.
+    :param file_id: Id of the source data file (from avaandmed.eesti.ee dataset info)
+    :param cleaning_schema: JSON serializable description of the cleaning steps (translations, column lists etc.)
+    :return: Hex digest string
+    """
+    schema_string = json.dumps(cleaning_schema, sort_keys=True, ensure_ascii=False)
+    schema_hash = hashlib.sha256(schema_string.encode("utf-8")).hexdigest()
+    fingerprint = hashlib.sha256(f"{file_id}:{schema_hash}".encode("utf-8")).hexdigest()
+    return fingerprint[:16]
+
+
+def normalise_argument(value) -> str:
+    """
+    Convert a function argument to an unambiguous, stable string for use in cache keys.
+    Strings are JSON-quoted, so that their contents can't be mistaken for list or dict structure.
+    :param value: Any function argument
+    :return: String representation of the value
+    """
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, dict):
+        items = sorted((normalise_argument(key), normalise_argument(item)) for key, item in value.items())
+        return "{" + ",".join(f"{key}:{item}" for key, item in items) + "}"
+    if isinstance(value, list):
+        return "[" + ",".join(normalise_argument(item) for item in value) + "]"
+    if isinstance(value, tuple):
+        return "(" + ",".join(normalise_argument(item) for item in value) + ")"
+    return repr(value)
+
+
+def fingerprint_code(function) -> str:
+    """
+    Create a fingerprint of a function's code, so that cached results don't outlive code changes.
+    Covers the bytecode, constants and names of the function and of functions (e.g. lambdas) defined in it.
+    :param function: Function or bound method
+    :return: Hex digest string
+    """
+    code_hash = hashlib.sha256()
+
+    def add_code(code) -> None:
+        code_hash.update(code.co_code)
+        code_hash.update(repr(code.co_names).encode("utf-8"))
+        for constant in code.co_consts:
+            if inspect.iscode(constant):
+                add_code(constant)
+            else:
+                code_hash.update(repr(constant).encode("utf-8"))
+
+    code = getattr(getattr(function, "__func__", function), "__code__", None)
+    if code is not None:
+        add_code(code)
+    return code_hash.hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Memoization layer for data operations and scenario evaluations.
+    Results are kept in an in-process LRU and optionally pickled to disk.
+    Data frames are identified by fingerprints: the root dataset gets one from fingerprint_dataset
+    and every memoized result gets one derived from the function name and its inputs.
+    Memoized results are shared between calls and should be treated as read-only.
+    """
+
+    def __init__(self, max_entries: int = 128, cache_dir: str = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.dataset_fingerprint = None
+        self.entries = collections.OrderedDict()
+        self.statistics = collections.Counter()
+        # Guards the LRU, so the cache can be shared between threads
+        self._lock = threading.Lock()
+        # key -> [lock, number of threads using it], so that only one thread computes a missing result
+        self._key_locks = dict()
+        # id(frame) -> (weak reference to frame, frame fingerprint, dataset fingerprint)
+        self._frame_fingerprints = dict()
+
+    def register_frame(self, frame: pandas.DataFrame, fingerprint: str, dataset_fingerprint: str) -> None:
+        """
+        Attach a fingerprint to a data frame object.
+        :param frame: Data frame
+        :param fingerprint: Fingerprint of the frame contents
+        :param dataset_fingerprint: Fingerprint of the dataset version the frame is derived from
+        """
+        frame_id = id(frame)
+
+        def forget(dead_reference: weakref.ref) -> None:
+            # Only forget the entry, if the id hasn't already been reused by another frame
+            if self._frame_fingerprints.get(frame_id, (None,))[0] is dead_reference:
+                del self._frame_fingerprints[frame_id]
+
+        reference = weakref.ref(frame, forget)
+        self._frame_fingerprints[frame_id] = (reference, fingerprint, dataset_fingerprint)
+
+    def register_dataset(self, frame: pandas.DataFrame, dataset_fingerprint: str) -> None:
+        """
+        Register the cleaned root data frame of a dataset version.
+        If the dataset version changed, all results of previous versions are invalidated.
+        :param frame: Cleaned data frame
+        :param dataset_fingerprint: Output of fingerprint_dataset
+        """
+        if self.dataset_fingerprint is not None and self.dataset_fingerprint != dataset_fingerprint:
+            logging.info(f"Dataset version changed from {self.dataset_fingerprint} to {dataset_fingerprint}")
+            self.invalidate(keep=dataset_fingerprint)
+        elif self.dataset_fingerprint is None and self.cache_dir is not None:
+            # Remove on-disk results from previous runs on other dataset versions
+            self.invalidate(keep=dataset_fingerprint)
+        self.dataset_fingerprint = dataset_fingerprint
+        self.register_frame(frame, dataset_fingerprint, dataset_fingerprint)
+
+    def frame_fingerprint(self, frame: pandas.DataFrame) -> (str, str):
+        """
+        Get fingerprint of a data frame.
+        Falls back to hashing the frame contents, if the frame is not registered.
+        :param frame: Data frame
+        :return: Frame fingerprint and dataset fingerprint (None for unregistered frames)
+        """
+        registered = self._frame_fingerprints.get(id(frame))
+        if registered is not None and registered[0]() is frame:
+            return registered[1], registered[2]
+        content_hash = hashlib.sha256(pandas.util.hash_pandas_object(frame, index=True).values.tobytes())
+        content_hash.update(normalise_argument(list(frame.columns)).encode("utf-8"))
+        return content_hash.hexdigest()[:16], None
+
+    def _make_key(self, function_name: str, arguments: dict, normalise_whitespace: tuple) -> (str, str):
+        dataset_fingerprint = None
+        key_parts = [function_name]
+        for name, value in arguments.items():
+            if isinstance(value, pandas.DataFrame):
+                value_fingerprint, value_dataset_fingerprint = self.frame_fingerprint(value)
+                dataset_fingerprint = dataset_fingerprint or value_dataset_fingerprint
+                key_parts.append(f"{name}=frame:{value_fingerprint}")
+            else:
+                if name in normalise_whitespace and isinstance(value, str):
+                    value = " ".join(value.split())
+                key_parts.append(f"{name}={normalise_argument(value)}")
+        digest = hashlib.sha256("|".join(key_parts).encode("utf-8")).hexdigest()[:16]
+        # Results of content-keyed frames are stored under the current dataset version,
+        # so that they are pruned together with it
+        dataset_fingerprint = dataset_fingerprint or self.dataset_fingerprint or UNVERSIONED
+        return f"{dataset_fingerprint}:{digest}", dataset_fingerprint
+
+    def _disk_path(self, key: str) -> str:
+        dataset_fingerprint, digest = key.split(":")
+        return os.path.join(self.cache_dir, dataset_fingerprint, f"{digest}.pickle")
+
+    def get(self, key: str):
+        """
+        Look up a result from memory, then from disk.
+        :param key: Cache key
+        :return: (True, result) if found, else (False, None)
+        """
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.statistics["memory_hits"] += 1
+                return True, self.entries[key]
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                try:
+                    with open(path, "rb") as cache_file:
+                        result = pickle.load(cache_file)
+                except (OSError, pickle.UnpicklingError, EOFError) as error:
+                    logging.warning(f"Could not read cached result {path}: {error}")
+                else:
+                    with self._lock:
+                        self.statistics["disk_hits"] += 1
+                    self._store_in_memory(key, result)
+                    return True, result
+        with self._lock:
+            self.statistics["misses"] += 1
+        return False, None
+
+    def _store_in_memory(self, key: str, result) -> None:
+        with self._lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.statistics["evictions"] += 1
+
+    def put(self, key: str, result) -> None:
+        """
+        Store a result in memory and, if a cache directory is set, on disk.
+        :param key: Cache key
+        :param result: Result to store
+        """
+        self._store_in_memory(key, result)
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "wb") as cache_file:
+                pickle.dump(result, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+
+    @contextlib.contextmanager
+    def _key_lock(self, key: str):
+        """
+        Hold a lock for a single cache key. Locks are removed when no thread uses them.
+        :param key: Cache key
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                yield
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0:
+                    del self._key_locks[key]
+
+    def memoize(self, function, normalise_whitespace: (list | tuple) = ()):
+        """
+        Wrap a function, so that its results are cached by the fingerprints of its inputs.
+        Data frame results are registered, so that chained calls get cheap cache keys.
+        Only one thread at a time computes a result for a key, other threads with the same key wait for it.
+        :param function: Function to wrap (e.g. from data_operations)
+        :param normalise_whitespace: Names of string arguments where runs of whitespace don't matter
+        (e.g. query predicates split over several lines)
+        :return: Wrapped function
+        """
+        # Results of changed code or an older cache version get different keys
+        function_name = (f"{function.__module__}.{function.__qualname__}"
+                         f"@{fingerprint_code(function)}/v{CACHE_VERSION}")
+        signature = inspect.signature(function)
+        normalise_whitespace = tuple(normalise_whitespace)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Bind arguments to names, so that positional and keyword calls get the same key
+            bound_arguments = signature.bind(*args, **kwargs)
+            bound_arguments.apply_defaults()
+            key, dataset_fingerprint = self._make_key(function_name, bound_arguments.arguments, normalise_whitespace)
+            # Concurrent calls with the same key wait for the first one and then find its result
+            with self._key_lock(key):
+                found, result = self.get(key)
+                if found:
+                    logging.debug(f"Cache hit for {function_name} ({key})")
+                else:
+                    logging.debug(f"Cache miss for {function_name} ({key})")
+                    result = function(*args, **kwargs)
+                    self.put(key, result)
+            if isinstance(result, pandas.DataFrame):
+                self.register_frame(result, key.split(":")[1], dataset_fingerprint)
+            return result
+
+        return wrapper
+
+    def invalidate(self, dataset_fingerprint: str = None, keep: str = None) -> None:
+        """
+        Drop cached results from memory and disk.
+        :param dataset_fingerprint: Drop only results of this dataset version
+        :param keep: Drop results of all dataset versions except this one
+        Drops everything if neither is given. Only directories named like dataset versions are removed from disk.
+        """
+        def is_dropped(fingerprint: str) -> bool:
+            if dataset_fingerprint is not None:
+                return fingerprint == dataset_fingerprint
+            if keep is not None:
+                return fingerprint != keep
+            return True
+
+        with self._lock:
+            dropped_keys = [key for key in self.entries if is_dropped(key.split(":")[0])]
+            for key in dropped_keys:
+                del self.entries[key]
+            self.statistics["invalidated"] += len(dropped_keys)
+
+        if self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            for fingerprint in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, fingerprint)
+                if (os.path.isdir(path) and DATASET_DIRECTORY_PATTERN.fullmatch(fingerprint)
+                        and is_dropped(fingerprint)):
+                    shutil.rmtree(path, ignore_errors=True)
+                    logging.info(f"Removed cached results of dataset version {fingerprint}")
+
+    def log_statistics(self) -> None:
+        """Log hit and miss counts."""
+        hits = self.statistics["memory_hits"] + self.statistics["disk_hits"]
+        lookups = hits + self.statistics["misses"]
+        hit_rate = hits / lookups if lookups else 0
+        logging.info(
+            f"Result cache: {hits}/{lookups} hits ({hit_rate:.0%}), "
+            f"memory hits: {self.statistics['memory_hits']}, "
+            f"disk hits: {self.statistics['disk_hits']}, "
+            f"misses: {self.statistics['misses']}, "
+            f"evictions: {self.statistics['evictions']}, "
+            f"entries in memory: {len(self.entries)}")
@@ -0,0 +1,83 @@
+# external
+import numpy
+
+# L-EST97 (EPSG:3301) is a Lambert conformal conic projection on the GRS80 ellipsoid.
+# In Estonian convention (and in the traffic accidents data) x is northing and y is easting.
+# ETRS89 and WGS84 differ by less than a meter in Estonia, so the geographic coordinates are used as WGS84.
+SEMI_MAJOR_AXIS = 6378137.0
+INVERSE_FLATTENING = 298.257222101
+STANDARD_PARALLEL_1 = 59 + 20 / 60
+STANDARD_PARALLEL_2 = 58.0
+LATITUDE_OF_ORIGIN = 57.51755393055556
+CENTRAL_MERIDIAN = 24.0
+FALSE_EASTING = 500000.0
+FALSE_NORTHING = 6375000.0
+
+_flattening = 1 / INVERSE_FLATTENING
+_eccentricity = numpy.sqrt(2 * _flattening - _flattening ** 2)
+
+
+def _m(latitude: numpy.ndarray) -> numpy.ndarray:
+    return numpy.cos(latitude) / numpy.sqrt(1 - (_eccentricity * numpy.sin(latitude)) ** 2)
+
+
+def _t(latitude: numpy.ndarray) -> numpy.ndarray:
+    e_sin = _eccentricity * numpy.sin(latitude)
+    return numpy.tan(numpy.pi / 4 - latitude / 2) / ((1 - e_sin) / (1 + e_sin)) ** (_eccentricity / 2)
+
+
+# Projection constants (Snyder, Map Projections - A Working Manual, p. 107-109)
+_phi_1, _phi_2, _phi_0 = numpy.radians([STANDARD_PARALLEL_1, STANDARD_PARALLEL_2, LATITUDE_OF_ORIGIN])
+_n = (numpy.log(_m(_phi_1)) - numpy.log(_m(_phi_2))) / (numpy.log(_t(_phi_1)) - numpy.log(_t(_phi_2)))
+_a_f = SEMI_MAJOR_AXIS * _m(_phi_1) / (_n * _t(_phi_1) ** _n)
+_rho_0 = _a_f * _t(_phi_0) ** _n
+
+# Series coefficients for converting conformal latitude back to geodetic latitude (Snyder eq. 3-5)
+_e2, _e4, _e6, _e8 = (_eccentricity ** power for power in (2, 4, 6, 8))
+_latitude_series = (
+    _e2 / 2 + 5 * _e4 / 24 + _e6 / 12 + 13 * _e8 / 360,
+    7 * _e4 / 48 + 29 * _e6 / 240 + 811 * _e8 / 11520,
+    7 * _e6 / 120 + 81 * _e8 / 1120,
+    4279 * _e8 / 161280)
+
+
+def lest97_to_wgs84(x, y) -> (numpy.ndarray, numpy.ndarray):
+    """
+    Convert L-EST97 coordinates to WGS84 latitude and longitude.
+    Works on whole arrays at once, missing values stay missing.
+    :param x: L-EST97 x coordinates (northing, meters)
+    :param y: L-EST97 y coordinates (easting, meters)
+    :return: latitude and longitude arrays in degrees
+    """
+    easting = numpy.asarray(y, dtype=float) - FALSE_EASTING
+    northing = _rho_0 - (numpy.asarray(x, dtype=float) - FALSE_NORTHING)
+
+    rho = numpy.hypot(easting, northing)
+    theta = numpy.arctan2(easting, northing)
+    t = (rho / _a_f) ** (1 / _n)
+
+    conformal_latitude = numpy.pi / 2 - 2 * numpy.arctan(t)
+    latitude = conformal_latitude.copy()
+    for order, coefficient in enumerate(_latitude_series, start=1):
+        latitude += coefficient * numpy.sin(2 * order * conformal_latitude)
+    longitude = theta / _n + numpy.radians(CENTRAL_MERIDIAN)
+
+    return numpy.degrees(latitude), numpy.degrees(longitude)
+
+
+def wgs84_to_lest97(latitude, longitude) -> (numpy.ndarray, numpy.ndarray):
+    """
+    Convert WGS84 latitude and longitude to L-EST97 coordinates.
+    :param latitude: Latitudes in degrees
+    :param longitude: Longitudes in degrees
+    :return: L-EST97 x (northing) and y (easting) arrays in meters
+    """
+    latitude = numpy.radians(numpy.asarray(latitude, dtype=float))
+    longitude = numpy.radians(numpy.asarray(longitude, dtype=float))
+
+    rho = _a_f * _t(latitude) ** _n
+    theta = _n * (longitude - numpy.radians(CENTRAL_MERIDIAN))
+
+    x = FALSE_NORTHING + _rho_0 - rho * numpy.cos(theta)
+    y = FALSE_EASTING + rho * numpy.sin(theta)
+    return x, y
@@ -1,5 +1,10 @@
+# standard
 import logging
+# external
+import numpy
 import pandas
+# local
+import coordinates
 
 
 def rename_with_check(data_frame: pandas.DataFrame, translations: dict) -> pandas.DataFrame:
@@ -16,6 +21,34 @@ def rename_with_check(data_frame: pandas.DataFrame, translations: dict) -> panda
     return data_frame.rename(columns=translations)
 
 
+def select_scenario(df: pandas.DataFrame, query: str) -> pandas.DataFrame:
+    # input column names
+    n_diseased = "n_diseased"
+    n_injured = "n_injured"
+
+    scenario_df = (
+        df
+        .assign(
+            # Summarize harm statistics
+            n_harmed=lambda table: table[n_diseased] + table[n_injured])
+        # Filter relevant accidents
+        .query(query)
+        )
+    return scenario_df
+
+
+def count_victims(df: pandas.DataFrame) -> pandas.DataFrame:
+    # input column names
+    n_harmed = "n_harmed"
+
+    victims_df = (
+        df
+        # Reduce harmed persons by 1 where causing driver is likely among them to get victims
+        .assign(n_harmed=lambda table: numpy.where(table[n_harmed] > 1, table[n_harmed] - 1, table[n_harmed]))
+        )
+    return victims_df
+
+
 def aggregate_harm_by_day(df: pandas.DataFrame):
     # input column names
     time = "time"
@@ -70,3 +103,226 @@ def add_cumulative(df: pandas.DataFrame):
     }
     df_cumulative = df.assign(**assign_kwargs)
     return df_cumulative
+
+
+def aggregate_harm_heatmaps(scenarios: dict, period: str = None) -> dict:
+    """
+    Aggregate harm by hour of day x weekday (and optionally month or season) for several scenarios at once.
+    All scenario frames are packed into a single array of integer keys and summed with one bincount.
+    :param scenarios: {scenario name: {mode name: data frame with time and n_harmed columns}}
+    e.g. {"h1": {"motor_vehicle": harmed_motor_vehicle_h1, "bicycle": harmed_bicycle_h1}}
+    :param period: None, "month" or "season" for an additional breakdown
+    :return: dict with "values" array of shape (scenario, mode, period, weekday, hour)
+    and the labels for each axis ("scenarios", "modes", "periods", "weekdays", "hours").
+    """
+    # input column names
+    time = "time"
+    n_harmed = "n_harmed"
+
+    nanoseconds_in_hour = 3600 * 10**9
+    n_hours = 24
+    n_weekdays = 7
+    # 1970-01-01 was a Thursday (weekday 3 when Monday is 0)
+    epoch_weekday = 3
+    period_labels = {
+        None: ["all"],
+        "month": ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"],
+        "season": ["winter", "spring", "summer", "autumn"]}
+    if period not in period_labels:
+        raise ValueError(f"Unknown period: {period}. Use one of: {', '.join(map(str, period_labels))}")
+
+    scenario_names = list(scenarios)
+    mode_names = list(dict.fromkeys(mode for modes in scenarios.values() for mode in modes))
+    n_periods = len(period_labels[period])
+    n_cells = n_periods * n_weekdays * n_hours
+
+    keys = []
+    weights = []
+    for scenario_index, scenario_name in enumerate(scenario_names):
+        for mode_name, df in scenarios[scenario_name].items():
+            mode_index = mode_names.index(mode_name)
+            timestamps = df[time].to_numpy(dtype="datetime64[ns]")
+            time_int = timestamps.view("int64")
+            hours_since_epoch = time_int // nanoseconds_in_hour
+            hour = hours_since_epoch % n_hours
+            weekday = (hours_since_epoch // n_hours + epoch_weekday) % n_weekdays
+            if period is None:
+                period_index = 0
+            else:
+                month = timestamps.astype("datetime64[M]").view("int64") % 12
+                # Seasons start from December: Dec-Feb is winter
+                period_index = month if period == "month" else (month + 1) % 12 // 3
+
+            scenario_mode_offset = (scenario_index * len(mode_names) + mode_index) * n_cells
+            keys.append(scenario_mode_offset + (period_index * n_weekdays + weekday) * n_hours + hour)
+            weights.append(df[n_harmed].to_numpy(dtype=float))
+
+    if keys:
+        packed_keys = numpy.concatenate(keys)
+        packed_weights = numpy.concatenate(weights)
+    else:
+        packed_keys = numpy.array([], dtype="int64")
+        packed_weights = numpy.array([], dtype=float)
+
+    values = numpy.bincount(
+        packed_keys,
+        weights=packed_weights,
+        minlength=len(scenario_names) * len(mode_names) * n_cells)
+    values = values.reshape(len(scenario_names), len(mode_names), n_periods, n_weekdays, n_hours)
+
+    heatmaps = {
+        "values": values,
+        "scenarios": scenario_names,
+        "modes": mode_names,
+        "periods": period_labels[period],
+        "weekdays": ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
+        "hours": list(range(n_hours))}
+    return heatmaps
+
+
+def aggregate_harm_by_grid(scenarios: dict, cell_size: float = 1000, grid: str = "hexagon") -> pandas.DataFrame:
+    """
+    Aggregate harm into hexagonal or square grid cells for several scenarios at once.
+    Cells are computed in L-EST97 meters for all scenario frames together and summed with one bincount.
+    Accidents without valid coordinates are left out.
+    :param scenarios: {scenario name: {mode name: data frame with gps_x, gps_y and n_harmed columns}}
+    :param cell_size: Square side or hexagon circumradius in meters
+    :param grid: "hexagon" or "square"
+    :return: Data frame with a row for each non-empty scenario, mode and cell:
+    cell center in L-EST97 (gps_x, gps_y) and WGS84 (latitude, longitude), n_accidents and n_harmed
+    """
+    # input column names
+    gps_x = "gps_x"
+    gps_y = "gps_y"
+    n_harmed = "n_harmed"
+
+    if grid not in ("hexagon", "square"):
+        raise ValueError(f"Unknown grid: {grid}. Use \"hexagon\" or \"square\".")
+
+    scenario_modes = [(scenario, mode) for scenario, modes in scenarios.items() for mode in modes]
+    frames = [scenarios[scenario][mode] for scenario, mode in scenario_modes]
+    northing = numpy.concatenate([numpy.asarray(df[gps_x], dtype=float) for df in frames] or [[]])
+    easting = numpy.concatenate([numpy.asarray(df[gps_y], dtype=float) for df in frames] or [[]])
+    harm = numpy.concatenate([numpy.asarray(df[n_harmed], dtype=float) for df in frames] or [[]])
+    scenario_mode_index = numpy.repeat(numpy.arange(len(frames)), [len(df) for df in frames])
+
+    # Missing coordinates are NaN or placeholders like -1
+    valid = (northing > 0) & (easting > 0)
+    northing, easting, harm, scenario_mode_index = (
+        northing[valid], easting[valid], harm[valid], scenario_mode_index[valid])
+
+    if grid == "square":
+        column = numpy.floor(easting / cell_size).astype("int64")
+        row = numpy.floor(northing / cell_size).astype("int64")
+        center_easting = (column + 0.5) * cell_size
+        center_northing = (row + 0.5) * cell_size
+    else:
+        # Pointy-top hexagons in axial coordinates, rounded via cube coordinates
+        q = (numpy.sqrt(3) / 3 * easting - northing / 3) / cell_size
+        r = (2 / 3 * northing) / cell_size
+        s = -q - r
+        q_round, r_round, s_round = numpy.round(q), numpy.round(r), numpy.round(s)
+        q_diff, r_diff, s_diff = numpy.abs(q_round - q), numpy.abs(r_round - r), numpy.abs(s_round - s)
+        fix_q = (q_diff > r_diff) & (q_diff > s_diff)
+        fix_r = ~fix_q & (r_diff > s_diff)
+        q_round = numpy.where(fix_q, -r_round - s_round, q_round)
+        r_round = numpy.where(fix_r, -q_round - s_round, r_round)
+        column = q_round.astype("int64")
+        row = r_round.astype("int64")
+        center_easting = cell_size * numpy.sqrt(3) * (column + row / 2)
+        center_northing = cell_size * 1.5 * row
+
+    # Pack scenario, mode and cell into one key
+    column_offset, row_offset = column.min(initial=0), row.min(initial=0)
+    n_columns = column.max(initial=0) - column_offset + 1
+    n_rows = row.max(initial=0) - row_offset + 1
+    packed_keys = (scenario_mode_index * n_rows + (row - row_offset)) * n_columns + (column - column_offset)
+
+    unique_keys, first_index, inverse = numpy.unique(packed_keys, return_index=True, return_inverse=True)
+    harm_sums = numpy.bincount(inverse, weights=harm, minlength=len(unique_keys))
+    accident_counts = numpy.bincount(inverse, minlength=len(unique_keys))
+
+    cell_northing = center_northing[first_index]
+    cell_easting = center_easting[first_index]
+    latitude, longitude = coordinates.lest97_to_wgs84(cell_northing, cell_easting)
+    cell_scenario_modes = scenario_mode_index[first_index]
+
+    harm_by_grid = pandas.DataFrame({
+        "scenario": [scenario_modes[index][0] for index in cell_scenario_modes],
+        "mode": [scenario_modes[index][1] for index in cell_scenario_modes],
+        gps_x: cell_northing,
+        gps_y: cell_easting,
+        "latitude": latitude,
+        "longitude": longitude,
+        "n_accidents": accident_counts,
+        n_harmed: harm_sums})
+    return harm_by_grid
+
+
+def summarize_scenarios(df: pandas.DataFrame, scenario_masks: dict, group_by: list = None,
+                        columns: list = None) -> pandas.DataFrame:
+    """
+    Count, sum, mean and per accident rate of accident statistics for every scenario and group at once.
+    Scenarios may overlap. All scenario x group x column sums are done with one bincount over packed keys.
+    :param df: Cleaned traffic accidents data
+    :param scenario_masks: {scenario name: boolean array selecting the scenario's accidents from df}
+    :param group_by: Column names of df or Series aligned with df to group by (e.g. year, county)
+    :param columns: Columns to summarize, by default n_injured, n_diseased, n_participants and n_vehicles
+    :return: Tidy data frame with a row for each scenario, group and column:
+    n_accidents, count (non-missing values), sum, mean and per_accident (sum / n_accidents)
+    """
+    columns = columns or ["n_injured", "n_diseased", "n_participants", "n_vehicles"]
+    group_by = group_by or []
+
+    # Combine group keys into a single group code
+    group_names = list()
+    group_codes = list()
+    group_labels = list()
+    for key in group_by:
+        key_values = df[key] if isinstance(key, str) else pandas.Series(key, index=df.index)
+        codes, labels = pandas.factorize(key_values, sort=True, use_na_sentinel=False)
+        group_names.append(key if isinstance(key, str) else key_values.name)
+        group_codes.append(codes)
+        group_labels.append(labels)
+    group_shape = tuple(len(labels) for labels in group_labels)
+    group_code = (numpy.ravel_multi_index(group_codes, group_shape) if group_by
+                  else numpy.zeros(len(df), dtype="int64"))
+    n_groups = int(numpy.prod(group_shape)) if group_by else 1
+
+    scenario_names = list(scenario_masks)
+    mask_matrix = numpy.vstack([numpy.asarray(mask, dtype=bool) for mask in scenario_masks.values()])
+    scenario_index, row_index = numpy.nonzero(mask_matrix)
+    keys = scenario_index * n_groups + group_code[row_index]
+
+    # Pack scenario x group x column into one key
+    n_cells = len(scenario_names) * n_groups
+    n_columns = len(columns)
+    values = df[columns].to_numpy(dtype=float)[row_index]
+    packed_keys = (keys[:, numpy.newaxis] * n_columns + numpy.arange(n_columns)).ravel()
+    is_present = ~numpy.isnan(values)
+    sums = numpy.bincount(packed_keys, weights=numpy.where(is_present, values, 0).ravel(),
+                          minlength=n_cells * n_columns).reshape(n_cells, n_columns)
+    counts = numpy.bincount(packed_keys, weights=is_present.ravel(),
+                            minlength=n_cells * n_columns).reshape(n_cells, n_columns)
+    n_accidents = numpy.bincount(keys, minlength=n_cells)
+
+    # Keep empty groups out, but keep every scenario when there is no grouping
+    cells = numpy.flatnonzero(n_accidents > 0) if group_by else numpy.arange(n_cells)
+    cell_scenarios, cell_groups = numpy.divmod(cells, n_groups)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        means = sums[cells] / counts[cells]
+        per_accident = sums[cells] / n_accidents[cells, numpy.newaxis]
+
+    summary = {"scenario": numpy.repeat(numpy.array(scenario_names, dtype=object)[cell_scenarios], n_columns)}
+    if group_by:
+        for name, codes, labels in zip(group_names, numpy.unravel_index(cell_groups, group_shape), group_labels):
+            summary[name] = numpy.repeat(numpy.asarray(labels)[codes], n_columns)
+    summary.update({
+        "variable": numpy.tile(columns, len(cells)),
+        "n_accidents": numpy.repeat(n_accidents[cells], n_columns),
+        "count": counts[cells].ravel().astype("int64"),
+        "sum": sums[cells].ravel(),
+        "mean": means.ravel(),
+        "per_accident": per_accident.ravel()})
+    return pandas.DataFrame(summary)
@@ -0,0 +1,222 @@
+# standard
+import io
+# external
+import numpy
+import pandas
+# local
+import api_interface
+
+# Record spacing over this multiple of a station's median spacing is treated as a gap in the counter data
+MAX_SPACING_TO_MEDIAN = 1.5
+
+
+def day_ordinals(times) -> numpy.ndarray:
+    """
+    Convert times to day numbers (days since 1970-01-01).
+    :param times: Array-like of datetimes
+    :return: int64 array of day ordinals
+    """
+    timestamps = numpy.asarray(pandas.to_datetime(times), dtype="datetime64[ns]")
+    return timestamps.astype("datetime64[D]").view("int64")
+
+
+def _valid_records(times, values, stations) -> (numpy.ndarray, numpy.ndarray, numpy.ndarray):
+    """
+    Drop records with missing times or non-finite values, so they don't spread NaN over other days.
+    :param times: Array-like of datetimes
+    :param values: Array-like of counts or levels
+    :param stations: Array-like of station ids or None
+    :return: Day ordinals, values and station ids of valid records
+    """
+    timestamps = numpy.asarray(pandas.to_datetime(times), dtype="datetime64[ns]")
+    values = numpy.asarray(values, dtype=float)
+    stations = numpy.zeros(len(timestamps), dtype="int64") if stations is None else numpy.asarray(stations)
+    is_valid = ~numpy.isnat(timestamps) & numpy.isfinite(values)
+    if not is_valid.any():
+        raise ValueError("No records with both a valid time and a finite value")
+    return day_ordinals(timestamps[is_valid]), values[is_valid], stations[is_valid]
+
+
+class DailyExposure:
+    """
+    Exposure (e.g. vehicles or cyclists counted) per day on a dense range of day ordinals.
+    Days that no counter reported on are NaN.
+    """
+
+    def __init__(self, first_day: int, values: numpy.ndarray):
+        self.first_day = int(first_day)
+        self.values = numpy.asarray(values, dtype=float)
+        # Cumulative exposure with missing days counted as zero, prefixed with 0 for differences
+        self._cumulative = numpy.concatenate([[0], numpy.cumsum(numpy.nan_to_num(self.values))])
+
+    @classmethod
+    def from_counts(cls, times, counts, stations=None, period_days: float = None) -> "DailyExposure":
+        """
+        Build exposure from counter totals (interval join).
+        Each count covers the time from its record until the next record of the same station
+        and is spread evenly over the days in that interval.
+        Hourly counts are summed to their day, monthly counts are spread over the month etc.
+        :param times: Start times of the counting intervals
+        :param counts: Counted totals for each interval
+        :param stations: Counter station ids, if data from several counters is combined
+        :param period_days: Length of the counting interval in days.
+        If not given, the interval ends at the next record of the station. Intervals longer than
+        MAX_SPACING_TO_MEDIAN times the station's median interval, and the last record, use the median interval.
+        Records with a missing time or count are ignored.
+        :return: DailyExposure
+        """
+        days, counts, stations = _valid_records(times, counts, stations)
+        order = numpy.lexsort((days, stations))
+        days, counts, stations = days[order], counts[order], stations[order]
+
+        if period_days is not None:
+            end_days = days + max(1, int(round(period_days)))
+        else:
+            # Interval until the next record of the same station
+            next_days = numpy.append(days[1:], days[-1:])
+            is_last_of_station = numpy.append(stations[1:] != stations[:-1], True)
+            spacing = numpy.where(is_last_of_station, 0, next_days - days)
+            # Spacing much longer than usual for the station is a gap in the data, not a longer counting interval.
+            # Gaps and the last record of each station are given the station's median interval instead.
+            station_codes = numpy.unique(stations, return_inverse=True)[1]
+            median_spacing = numpy.ceil(
+                pandas.Series(numpy.where(spacing > 0, spacing, numpy.nan))
+                .groupby(station_codes)
+                .transform("median")
+                .fillna(1)
+                .to_numpy())
+            is_gap = spacing > MAX_SPACING_TO_MEDIAN * median_spacing
+            spacing = numpy.where(is_last_of_station | is_gap, median_spacing, spacing)
+            end_days = days + numpy.maximum(spacing, 1).astype("int64")
+
+        first_day = days.min()
+        n_days = end_days.max() - first_day + 1
+        interval_length = end_days - days
+        # Difference arrays: add at interval start, subtract at interval end, then cumulative sum
+        rate_changes = numpy.bincount(days - first_day, weights=counts / interval_length, minlength=n_days)
+        rate_changes -= numpy.bincount(end_days - first_day, weights=counts / interval_length, minlength=n_days)
+        coverage_changes = numpy.bincount(days - first_day, minlength=n_days)
+        coverage_changes -= numpy.bincount(end_days - first_day, minlength=n_days)
+
+        values = numpy.cumsum(rate_changes)
+        values[numpy.cumsum(coverage_changes) == 0] = numpy.nan
+        return cls(first_day, values[:-1])
+
+    @classmethod
+    def from_levels(cls, times, levels, stations=None, tolerance_days: int = 366) -> "DailyExposure":
+        """
+        Build exposure from reported daily levels (as-of join), e.g. average daily traffic.
+        Each day gets the latest level reported on or before it, if it is no older than the tolerance.
+        Levels of several stations are summed.
+        :param times: Times the levels were reported for
+        :param levels: Exposure per day
+        :param stations: Counter station ids, if data from several counters is combined
+        :param tolerance_days: Maximum age of a level in days
+        Records with a missing time or level are ignored.
+        :return: DailyExposure
+        """
+        days, levels, stations = _valid_records(times, levels, stations)
+
+        first_day = days.min()
+        dense_days = numpy.arange(first_day, days.max() + tolerance_days + 1)
+        values = numpy.full(len(dense_days), numpy.nan)
+        for station in numpy.unique(stations):
+            is_station = stations == station
+            station_days, station_levels = days[is_station], levels[is_station]
+            order = numpy.argsort(station_days, kind="stable")
+            station_days, station_levels = station_days[order], station_levels[order]
+
+            latest = numpy.searchsorted(station_days, dense_days, side="right") - 1
+            valid = latest >= 0
+            valid[valid] = dense_days[valid] - station_days[latest[valid]] <= tolerance_days
+            station_values = numpy.where(valid, station_levels[numpy.maximum(latest, 0)], numpy.nan)
+            values = numpy.where(numpy.isnan(values), station_values, values + numpy.nan_to_num(station_values))
+        return cls(first_day, values)
+
+    def at(self, days) -> numpy.ndarray:
+        """
+        Look up exposure for given days.
+        :param days: Day ordinals (see day_ordinals)
+        :return: Exposure per day, NaN outside the covered range
+        """
+        index = numpy.asarray(days, dtype="int64") - self.first_day
+        inside = (index >= 0) & (index < len(self.values))
+        return numpy.where(inside, self.values[numpy.clip(index, 0, len(self.values) - 1)], numpy.nan)
+
+    def cumulative(self, days, start_day: int) -> numpy.ndarray:
+        """
+        Total exposure from start_day until each of the given days (inclusive). Missing days count as zero.
+        :param days: Day ordinals
+        :param start_day: First day ordinal to include
+        :return: Cumulative exposure
+        """
+        def cumulative_until(day_index):
+            return self._cumulative[numpy.clip(day_index, 0, len(self.values))]
+
+        end_index = numpy.asarray(days, dtype="int64") - self.first_day + 1
+        return cumulative_until(end_index) - cumulative_until(start_day - self.first_day)
+
+
+def get_counter_data(api: api_interface.ApiInterface, dataset_id: str, file_id: str,
+                     delimiter: str = ",") -> pandas.DataFrame:
+    """
+    Download a counter data file from avaandmed.eesti.ee.
+    :param api: ApiInterface object
+    :param dataset_id: Dataset id (from dataset page in avaandmed.eesti.ee)
+    :param file_id: File id (from dataset info)
+    :param delimiter: CSV delimiter
+    :return: Data frame with file contents
+    """
+    file_response = api.get_file(dataset_id=dataset_id, file_id=file_id)
+    # noinspection PyTypeChecker
+    # (Pycharm/Pandas type hint conflict)
+    counter_data = pandas.read_csv(io.StringIO(file_response.text), delimiter=delimiter)
+    return counter_data
+
+
+def add_exposure_rates(df: pandas.DataFrame, exposures: dict, per: float = 1e6) -> pandas.DataFrame:
+    """
+    Add harm per exposure to per-day harm data.
+    Cumulative rates only include days that have exposure data.
+    :param df: Output of data_operations.join_by_day or add_cumulative
+    :param exposures: {"motor_vehicle": DailyExposure, "bicycle": DailyExposure}
+    :param per: Unit of exposure for rates, e.g. harm per million vehicles counted
+    :return: Data frame with added exposure, rate and cumulative rate columns for each mode
+    """
+    # input column names
+    day = "day"
+
+    days = day_ordinals(df[day])
+    assign_kwargs = dict()
+    for mode, exposure in exposures.items():
+        n_harmed = f"n_harmed_{mode}"
+        harm = df[n_harmed].to_numpy(dtype=float)
+        daily_exposure = exposure.at(days)
+        is_covered = ~numpy.isnan(daily_exposure)
+
+        covered_harm_cumulative = numpy.cumsum(numpy.where(is_covered, harm, 0))
+        exposure_cumulative = exposure.cumulative(days, start_day=days.min())
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            rate = harm / daily_exposure * per
+            rate_cumulative = covered_harm_cumulative / exposure_cumulative * per
+
+        assign_kwargs[f"exposure_{mode}"] = daily_exposure
+        assign_kwargs[f"{n_harmed}_per_exposure"] = rate
+        assign_kwargs[f"{n_harmed}_per_exposure_cumulative"] = numpy.where(
+            exposure_cumulative > 0, rate_cumulative, numpy.nan)
+
+    df_rates = df.assign(**assign_kwargs)
+    return df_rates
+
+
+def exposure_ratio(df: pandas.DataFrame) -> float:
+    """
+    Ratio of motor vehicle and bicycle harm per exposure over the whole period.
+    :param df: Output of add_exposure_rates with both modes
+    :return: Motor vehicle rate / bicycle rate
+    """
+    # input column names
+    motor_vehicle_rate = "n_harmed_motor_vehicle_per_exposure_cumulative"
+    bicycle_rate = "n_harmed_bicycle_per_exposure_cumulative"
+
+    return df[motor_vehicle_rate].iloc[-1] / df[bicycle_rate].iloc[-1]
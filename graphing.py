@@ -1,10 +1,45 @@
 # external
+import numpy
 import pandas
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
 
-def daily_results(data: pandas.DataFrame, motor_vehicle_title: str, bicycle_title: str):
+def min_max_decimate(y: numpy.ndarray, n_buckets: int) -> numpy.ndarray:
+    """
+    Select indices of points to plot, so that peaks are kept.
+    Splits the series into consecutive buckets and keeps the minimum and maximum of each bucket.
+    :param y: Values of the series
+    :param n_buckets: Number of buckets (about half the number of points to keep)
+    :return: Sorted array of indices to keep
+    """
+    n_points = len(y)
+    if n_points <= 2 * n_buckets:
+        return numpy.arange(n_points)
+    bucket = numpy.arange(n_points) * n_buckets // n_points
+    # Sort by value within buckets: first item of a bucket is its minimum, last is its maximum
+    order = numpy.lexsort((y, bucket))
+    bucket_starts = numpy.flatnonzero(numpy.diff(bucket, prepend=-1))
+    bucket_ends = numpy.append(bucket_starts[1:], n_points) - 1
+    keep = numpy.concatenate([order[bucket_starts], order[bucket_ends], [0, n_points - 1]])
+    return numpy.unique(keep)
+
+
+def daily_results(data: pandas.DataFrame, motor_vehicle_title: str, bicycle_title: str,
+                  render_mode: str = "full", target_width: int = 1000, show: bool = True) -> go.Figure:
+    """
+    Plot cumulative and daily harm for motor vehicles and bicycles.
+    :param data: Output of data_operations.add_cumulative
+    :param motor_vehicle_title: Legend title for motor vehicle data
+    :param bicycle_title: Legend title for bicycle data
+    :param render_mode: "full" for one bar per day,
+    "webgl" for WebGL traces with series downsampled to about one point per pixel (peaks are kept)
+    :param target_width: Plot width in pixels that the "webgl" mode downsamples for
+    :param show: True/False - open the figure in browser
+    :return: Plotly figure
+    """
+    if render_mode not in ("full", "webgl"):
+        raise ValueError(f"Unknown render mode: {render_mode}. Use \"full\" or \"webgl\".")
     motor_vehicle_color = "#526a83"
     bicycle_color = "#a06177"
     # input column names
@@ -13,12 +48,12 @@ def daily_results(data: pandas.DataFrame, motor_vehicle_title: str, bicycle_titl
     n_harmed_bicycle_cumulative = "n_harmed_bicycle_cumulative"
     n_harmed_motor_vehicle_cumulative = "n_harmed_motor_vehicle_cumulative"
 
-    daily_yaxis_max = 1.1 * max([max(data[n_harmed_bicycle]),
-                                 max(data[n_harmed_motor_vehicle])])
-    cumulative_yaxis_max = 1.1 * max([max(data[n_harmed_bicycle_cumulative]),
-                                      max(data[n_harmed_motor_vehicle_cumulative])])
-    xaxis_min = min(data["day"])
-    xaxis_max = max(data["day"])
+    days = data["day"].to_numpy()
+    daily_yaxis_max = 1.1 * data[[n_harmed_bicycle, n_harmed_motor_vehicle]].to_numpy().max()
+    cumulative_maxima = data[[n_harmed_bicycle_cumulative, n_harmed_motor_vehicle_cumulative]].max()
+    cumulative_yaxis_max = 1.1 * cumulative_maxima.max()
+    xaxis_min = days.min()
+    xaxis_max = days.max()
 
     figure = make_subplots(
         rows=3, cols=1,
@@ -26,62 +61,108 @@ def daily_results(data: pandas.DataFrame, motor_vehicle_title: str, bicycle_titl
         shared_xaxes=True,
         vertical_spacing=0.05)
 
-    motor_vehicle_by_day_graph = go.Bar(
-        name="participants in motor vehicle accidents per day",
-        x=data["day"],
-        y=data[n_harmed_motor_vehicle],
-        marker=dict(
-            color=motor_vehicle_color,
-            line_color=motor_vehicle_color),
-        showlegend=False)
+    if render_mode == "webgl":
+        n_buckets = max(1, target_width // 2)
 
-    bicycle_by_day_graph = go.Bar(
-        name="participants in bicycle accidents per day",
-        x=data["day"],
-        y=data[n_harmed_bicycle],
-        marker=dict(
-            color=bicycle_color,
-            line_color=bicycle_color),
-        showlegend=False)
-
-    motor_vehicle_cumulative_graph = go.Scatter(
-        name=motor_vehicle_title,
-        x=data["day"],
-        y=data[n_harmed_motor_vehicle_cumulative],
-        line=dict(
-            color=motor_vehicle_color,
-            width=1),
-        fill="tozeroy")
-
-    bicycle_cumulative_graph = go.Scatter(
-        name=bicycle_title,
-        x=data["day"],
-        y=data[n_harmed_bicycle_cumulative],
-        line=dict(
-            color=bicycle_color,
-            width=1),
-        fill="tozeroy")
+        def series(column: str) -> dict:
+            values = data[column].to_numpy()
+            keep = min_max_decimate(values, n_buckets)
+            return dict(x=days[keep], y=values[keep])
+
+        motor_vehicle_by_day_graph = go.Scattergl(
+            name="participants in motor vehicle accidents per day",
+            **series(n_harmed_motor_vehicle),
+            mode="lines",
+            line=dict(
+                color=motor_vehicle_color,
+                width=1),
+            fill="tozeroy",
+            showlegend=False)
+
+        bicycle_by_day_graph = go.Scattergl(
+            name="participants in bicycle accidents per day",
+            **series(n_harmed_bicycle),
+            mode="lines",
+            line=dict(
+                color=bicycle_color,
+                width=1),
+            fill="tozeroy",
+            showlegend=False)
+
+        motor_vehicle_cumulative_graph = go.Scattergl(
+            name=motor_vehicle_title,
+            **series(n_harmed_motor_vehicle_cumulative),
+            mode="lines",
+            line=dict(
+                color=motor_vehicle_color,
+                width=1),
+            fill="tozeroy")
+
+        bicycle_cumulative_graph = go.Scattergl(
+            name=bicycle_title,
+            **series(n_harmed_bicycle_cumulative),
+            mode="lines",
+            line=dict(
+                color=bicycle_color,
+                width=1),
+            fill="tozeroy")
+    else:
+        motor_vehicle_by_day_graph = go.Bar(
+            name="participants in motor vehicle accidents per day",
+            x=data["day"],
+            y=data[n_harmed_motor_vehicle],
+            marker=dict(
+                color=motor_vehicle_color,
+                line_color=motor_vehicle_color),
+            showlegend=False)
+
+        bicycle_by_day_graph = go.Bar(
+            name="participants in bicycle accidents per day",
+            x=data["day"],
+            y=data[n_harmed_bicycle],
+            marker=dict(
+                color=bicycle_color,
+                line_color=bicycle_color),
+            showlegend=False)
+
+        motor_vehicle_cumulative_graph = go.Scatter(
+            name=motor_vehicle_title,
+            x=data["day"],
+            y=data[n_harmed_motor_vehicle_cumulative],
+            line=dict(
+                color=motor_vehicle_color,
+                width=1),
+            fill="tozeroy")
+
+        bicycle_cumulative_graph = go.Scatter(
+            name=bicycle_title,
+            x=data["day"],
+            y=data[n_harmed_bicycle_cumulative],
+            line=dict(
+                color=bicycle_color,
+                width=1),
+            fill="tozeroy")
 
     motor_vehicle_cumulative_highest = go.Scatter(
-        x=[max(data["day"])],
-        y=[max(data[n_harmed_motor_vehicle_cumulative])],
+        x=[xaxis_max],
+        y=[cumulative_maxima[n_harmed_motor_vehicle_cumulative]],
         mode="markers+text",
         marker=dict(
             color=motor_vehicle_color,
             size=8),
-        text=[int(max(data[n_harmed_motor_vehicle_cumulative]))],
+        text=[int(cumulative_maxima[n_harmed_motor_vehicle_cumulative])],
         textposition="middle right",
         showlegend=False,
         cliponaxis=False)
 
     bicycle_cumulative_highest = go.Scatter(
-        x=[max(data["day"])],
-        y=[max(data[n_harmed_bicycle_cumulative])],
+        x=[xaxis_max],
+        y=[cumulative_maxima[n_harmed_bicycle_cumulative]],
         mode="markers+text",
         marker=dict(
             color=bicycle_color,
             size=8),
-        text=[int(max(data[n_harmed_bicycle_cumulative]))],
+        text=[int(cumulative_maxima[n_harmed_bicycle_cumulative])],
         textposition="middle right",
         showlegend=False,
         cliponaxis=False)
@@ -114,4 +195,55 @@ def daily_results(data: pandas.DataFrame, motor_vehicle_title: str, bicycle_titl
             bgcolor="rgba(0,0,0,0)"))
     figure.update_yaxes(gridcolor="lightgrey")
 
-    figure.show()
+    if show:
+        figure.show()
+    return figure
+
+
+def harm_heatmaps(heatmaps: dict, scenario: str, title: str = None, show: bool = True) -> go.Figure:
+    motor_vehicle_colorscale = [[0, "white"], [1, "#526a83"]]
+    bicycle_colorscale = [[0, "white"], [1, "#a06177"]]
+    default_colorscale = [[0, "white"], [1, "black"]]
+    colorscales = {"motor_vehicle": motor_vehicle_colorscale, "bicycle": bicycle_colorscale}
+
+    scenario_index = heatmaps["scenarios"].index(scenario)
+    modes = heatmaps["modes"]
+    periods = heatmaps["periods"]
+
+    figure = make_subplots(
+        rows=len(periods), cols=len(modes),
+        shared_xaxes=True,
+        shared_yaxes=True,
+        horizontal_spacing=0.03,
+        vertical_spacing=0.02,
+        column_titles=[mode.replace("_", " ") for mode in modes],
+        row_titles=periods if len(periods) > 1 else None)
+
+    for mode_index, mode in enumerate(modes):
+        # Use a common color range for all periods of a mode
+        mode_values = heatmaps["values"][scenario_index, mode_index]
+        zmax = mode_values.max() or 1
+        for period_index in range(len(periods)):
+            heatmap = go.Heatmap(
+                name=f"{mode.replace('_', ' ')} {periods[period_index]}",
+                x=heatmaps["hours"],
+                y=heatmaps["weekdays"],
+                z=mode_values[period_index],
+                zmin=0,
+                zmax=zmax,
+                colorscale=colorscales.get(mode, default_colorscale),
+                showscale=False,
+                hovertemplate="%{y} %{x}:00<br>deaths + injuries: %{z}<extra></extra>")
+            figure.add_trace(heatmap, row=period_index + 1, col=mode_index + 1)
+
+    figure.update_yaxes(autorange="reversed", tickfont_size=8)
+    figure.update_xaxes(dtick=3, tickfont_size=8)
+    figure.update_layout(
+        title=title,
+        autosize=False,
+        height=max(300, 150 * len(periods)),
+        plot_bgcolor="white")
+
+    if show:
+        figure.show()
+    return figure
@@ -0,0 +1,90 @@
+# standard
+import argparse
+import concurrent.futures
+import itertools
+import statistics
+import threading
+import time
+# external
+import requests
+
+
+DEFAULT_PATHS = [
+    "/scenarios",
+    "/ratios",
+    "/ratios?built_up=true",
+    "/series?scenario=h1",
+    "/series?scenario=h2&county=Harju maakond",
+    "/sites?x_min=6565550&x_max=6567850&y_min=542660&y_max=544382&change_date=2019-06-01"]
+
+
+def run_load_test(base_url: str, paths: list, n_requests: int, n_threads: int, revalidate: bool = False) -> dict:
+    """
+    Send requests to the analytics service from several threads and measure throughput and latency.
+    :param base_url: Service url, e.g. http://127.0.0.1:8000
+    :param paths: Request paths (with query) to cycle through
+    :param n_requests: Total number of requests
+    :param n_threads: Number of concurrent clients
+    :param revalidate: True/False - send If-None-Match with the ETag of the previous response to the same path
+    :return: dict with requests per second and latency percentiles in milliseconds
+    """
+    request_paths = list(itertools.islice(itertools.cycle(paths), n_requests))
+    local = threading.local()
+
+    def send(path: str) -> (float, int):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.etags = dict()
+        headers = {"If-None-Match": local.etags[path]} if revalidate and path in local.etags else {}
+        start = time.perf_counter()
+        response = local.session.get(base_url.rstrip("/") + path, headers=headers)
+        latency = time.perf_counter() - start
+        if "ETag" in response.headers:
+            local.etags[path] = response.headers["ETag"]
+        return latency, response.status_code
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+        results = list(executor.map(send, request_paths))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    status_counts = dict()
+    for _, status in results:
+        status_counts[status] = status_counts.get(status, 0) + 1
+
+    load_test_results = {
+        "requests": len(results),
+        "seconds": elapsed,
+        "requests_per_second": len(results) / elapsed,
+        "p50_ms": percentiles[49],
+        "p99_ms": percentiles[98],
+        "max_ms": latencies[-1],
+        "status_counts": status_counts}
+    return load_test_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the analytics service (server.py).")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--revalidate", action="store_true",
+                        help="Send If-None-Match with previously received ETags")
+    parser.add_argument("paths", nargs="*", default=DEFAULT_PATHS)
+    arguments = parser.parse_args()
+
+    load_test_results = run_load_test(
+        base_url=arguments.url,
+        paths=arguments.paths,
+        n_requests=arguments.requests,
+        n_threads=arguments.threads,
+        revalidate=arguments.revalidate)
+
+    print(f"{load_test_results['requests']} requests in {load_test_results['seconds']:.2f} s: "
+          f"{load_test_results['requests_per_second']:.1f} requests/s, "
+          f"p50 {load_test_results['p50_ms']:.1f} ms, "
+          f"p99 {load_test_results['p99_ms']:.1f} ms, "
+          f"max {load_test_results['max_ms']:.1f} ms, "
+          f"status codes: {load_test_results['status_counts']}")
@@ -2,14 +2,19 @@
 import os
 import io
 import json
+import logging
 # external
-import numpy as np
 import pandas as pd
 # local
 import api_interface
+import caching
+import coordinates
 import data_operations
+import exposure
 import general
 import graphing
+import reporting
+import scenarios
 
 
 ####################
@@ -17,6 +22,12 @@ import graphing
 ####################
 
 API_BASE_URL = "https://avaandmed.eesti.ee/api"
+# Bump when the data cleaning steps change, so that cached results of the old cleaning are not used
+CLEANING_VERSION = "2"
+# "full" for one bar per day, "webgl" for downsampled WebGL traces
+DAILY_RESULTS_RENDER_MODE = "webgl"
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 
 #############################################
@@ -24,11 +35,36 @@ API_BASE_URL = "https://avaandmed.eesti.ee/api"
 #############################################
 
 env_file_path = ".env"
-_ = general.parse_input_file(
+env_values = general.parse_input_file(
     path=env_file_path,
     set_environmental_variables=True)
 
 
+##########################
+# Set up results caching #
+##########################
+
+# Results are always cached in memory.
+# Set RESULT_CACHE_DIR in .env to also keep them on disk between runs.
+result_cache = caching.ResultCache(cache_dir=os.getenv("RESULT_CACHE_DIR"))
+
+select_scenario = result_cache.memoize(data_operations.select_scenario, normalise_whitespace=["query"])
+aggregate_harm_by_day = result_cache.memoize(data_operations.aggregate_harm_by_day)
+join_by_day = result_cache.memoize(data_operations.join_by_day)
+add_cumulative = result_cache.memoize(data_operations.add_cumulative)
+
+
+####################
+# Set up reporting #
+####################
+
+# All figures are collected into a single HTML report.
+# Set SHOW_FIGURES=false in .env for headless runs.
+show_figures = os.getenv("SHOW_FIGURES", "true").lower() == "true"
+report_path = os.getenv("REPORT_PATH", "traffic_stats_report.html")
+report = reporting.Report(title="Traffic harm from bicycle and motor vehicle use")
+
+
 ########################
 # Authorize API access #
 ########################
@@ -100,7 +136,7 @@ for column_name in column_name_translations:
 traffic_accidents = data_operations.rename_with_check(data_raw, column_name_translations_ee_en)
 
 # Convert dates to datetime
-traffic_accidents.loc[:, "time"] = pd.to_datetime(
+traffic_accidents["time"] = pd.to_datetime(
     arg=traffic_accidents["time"],
     format="mixed",
     dayfirst=True)
@@ -149,9 +185,39 @@ traffic_accidents = (
     traffic_accidents
     .apply(lambda x: map(bool, x) if x.name in boolean_columns else x))
 
+# Convert comma decimal strings to float (missing values become NaN)
+float_columns = ["route_km_marker", "gps_x", "gps_y"]
+for col in float_columns:
+    traffic_accidents[col] = pd.to_numeric(
+        traffic_accidents[col].astype(str).str.replace(",", "."),
+        errors="coerce")
+
+# Add WGS84 coordinates for mapping
+traffic_accidents["latitude"], traffic_accidents["longitude"] = coordinates.lest97_to_wgs84(
+    x=traffic_accidents["gps_x"],
+    y=traffic_accidents["gps_y"])
+
 # Sort by time
 traffic_accidents = traffic_accidents.sort_values(by="time")
 
+# Register dataset version for results caching
+# (Cached results of other source files or cleaning steps are dropped)
+cleaning_schema = {
+    "version": CLEANING_VERSION,
+    "column_name_translations": column_name_translations_ee_en,
+    "required_info_columns": required_info_columns,
+    "boolean_columns": boolean_columns,
+    "float_columns": float_columns}
+
+dataset_fingerprint = caching.fingerprint_dataset(
+    file_id=str(largest_file["id"]),
+    cleaning_schema=cleaning_schema)
+result_cache.register_dataset(traffic_accidents, dataset_fingerprint)
+
+# Save cleaned data for the analytics service (server.py)
+cleaned_data_path = os.getenv("CLEANED_DATA_PATH", "traffic_accidents.pickle")
+traffic_accidents.to_pickle(cleaned_data_path)
+
 
 #######################
 # Naive accident data #
@@ -165,8 +231,8 @@ naive_data = (
         n_harmed_bicycle=lambda df: (df["n_diseased"] + df["n_injured"]) * df["involves_cyclist"])
     )
 
-naive_data_by_day = data_operations.aggregate_harm_by_day(naive_data)
-naive = data_operations.add_cumulative(naive_data_by_day)
+naive_data_by_day = aggregate_harm_by_day(naive_data)
+naive = add_cumulative(naive_data_by_day)
 
 motor_vehicle_bicycle_total_ratio = (max(naive["n_harmed_motor_vehicle_cumulative"]) /
                                      max(naive["n_harmed_bicycle_cumulative"]))
@@ -176,49 +242,30 @@ motor_vehicle_bicycle_total_ratio = (max(naive["n_harmed_motor_vehicle_cumulativ
 # Naive accident data graph #
 #############################
 
-graphing.daily_results(
+naive_figure = graphing.daily_results(
     data=naive,
     motor_vehicle_title="total deaths + injuries in <b>motor vehicle</b> accidents",
-    bicycle_title="total deaths + injuries in <b>bicycle</b> accidents")
+    bicycle_title="total deaths + injuries in <b>bicycle</b> accidents",
+    render_mode=DAILY_RESULTS_RENDER_MODE,
+    show=show_figures)
+report.add("All accidents", naive_figure)
 
 
 ################
 # Victims data #
 ################
 
-victims_bicycle = (
-    traffic_accidents
-    .assign(
-        # Summarize harm statistics
-        n_harmed=lambda df: (df["n_diseased"] + df["n_injured"]))
-    # Filter relevant accidents
-    .query("(involves_cyclist & not involves_motor_vehicle_driver) & "
-           "(n_harmed > 1 | involves_personal_light_electric_vehicle_driver | involves_pedestrian)")
-    # Reduce harmed persons by 1 where causing driver is likely among them to get victims
-    .assign(n_harmed=lambda df: np.where(df["n_harmed"] > 1, df["n_harmed"] - 1, df["n_harmed"]))
-    )
+victims_bicycle = scenarios.select(traffic_accidents, "victims", "bicycle", select_scenario)
+victims_motor_vehicle = scenarios.select(traffic_accidents, "victims", "motor_vehicle", select_scenario)
 
-victims_motor_vehicle = (
-    traffic_accidents
-    .assign(
-        # Summarize harm statistics
-        n_harmed=lambda df: (df["n_diseased"] + df["n_injured"]))
-    # Filter relevant accidents
-    .query("involves_motor_vehicle_driver & "
-           "(n_harmed > 1 | involves_personal_light_electric_vehicle_driver | involves_pedestrian | "
-           "involves_passenger | involves_motorcycle_driver | involves_moped_driver | involves_cyclist)")
-    # Reduce harmed persons by 1 where causing driver is likely among them to get victims
-    .assign(n_harmed=lambda df: np.where(df["n_harmed"] > 1, df["n_harmed"] - 1, df["n_harmed"]))
-    )
-
-victims_bicycle_by_day = data_operations.aggregate_harm_by_day(victims_bicycle)
-victims_motor_vehicle_by_day = data_operations.aggregate_harm_by_day(victims_motor_vehicle)
+victims_bicycle_by_day = aggregate_harm_by_day(victims_bicycle)
+victims_motor_vehicle_by_day = aggregate_harm_by_day(victims_motor_vehicle)
 
-victims_joined = data_operations.join_by_day(
+victims_joined = join_by_day(
     df_bicycle=victims_bicycle_by_day,
     df_motor_vehicle=victims_motor_vehicle_by_day)
 
-victims = data_operations.add_cumulative(victims_joined)
+victims = add_cumulative(victims_joined)
 
 motor_vehicle_bicycle_victim_ratio = (max(victims["n_harmed_motor_vehicle_cumulative"]) /
                                       max(victims["n_harmed_bicycle_cumulative"]))
@@ -228,10 +275,40 @@ motor_vehicle_bicycle_victim_ratio = (max(victims["n_harmed_motor_vehicle_cumula
 # Victims data graph #
 ######################
 
-graphing.daily_results(
+victims_figure = graphing.daily_results(
     data=victims,
     motor_vehicle_title="victim deaths + injuries in <b>motor vehicle</b> accidents",
-    bicycle_title="victim deaths + injuries in <b>bicycle</b> accidents")
+    bicycle_title="victim deaths + injuries in <b>bicycle</b> accidents",
+    render_mode=DAILY_RESULTS_RENDER_MODE,
+    show=show_figures)
+report.add("Victims", victims_figure)
+
+
+###################################
+# Per accident summary statistics #
+###################################
+
+# Counts, sums, means and per accident rates for all scenarios in one pass
+scenario_masks = scenarios.masks(traffic_accidents)
+scenario_summary = data_operations.summarize_scenarios(
+    df=traffic_accidents,
+    scenario_masks=scenario_masks)
+per_accident = scenario_summary.set_index(["scenario", "variable"])["per_accident"]
+
+# Same by year, county, built-up area and speed limit
+speed_band = pd.cut(
+    traffic_accidents["speed_limit"],
+    bins=[0, 50, 70, 90, float("inf")],
+    labels=["<=50", "51-70", "71-90", ">90"])
+
+scenario_summary_by_group = data_operations.summarize_scenarios(
+    df=traffic_accidents,
+    scenario_masks=scenario_masks,
+    group_by=[
+        traffic_accidents["time"].dt.year.rename("year"),
+        "county_name",
+        "within_built_up_area",
+        speed_band.rename("speed_band")])
 
 
 ######################################################
@@ -239,90 +316,140 @@ graphing.daily_results(
 ######################################################
 
 # Hypothesis 1: it's always the cyclist's fault
-harmed_bicycle_h1 = (
-    traffic_accidents
-    .assign(
-        # Summarize harm statistics
-        n_harmed=lambda df: (df["n_diseased"] + df["n_injured"]))
-    # Filter relevant accidents
-    .query("involves_cyclist")
-    )
+harmed_bicycle_h1 = scenarios.select(traffic_accidents, "h1", "bicycle", select_scenario)
+harmed_motor_vehicle_h1 = scenarios.select(traffic_accidents, "h1", "motor_vehicle", select_scenario)
 
-harmed_motor_vehicle_h1 = (
-    traffic_accidents
-    .assign(
-        # Summarize harm statistics
-        n_harmed=lambda df: (df["n_diseased"] + df["n_injured"]))
-    # Filter relevant accidents
-    .query("involves_motor_vehicle_driver & "
-           "not involves_truck_driver & "
-           "not involves_bus_driver & "
-           "not involves_cyclist &"
-           "(within_built_up_area | speed_limit <= 50)")
-    )
-
-injured_per_accident_h1_motor_vehicle = sum(harmed_motor_vehicle_h1["n_injured"]) / len(harmed_motor_vehicle_h1)
-injured_per_accident_h1_bicycle = sum(harmed_bicycle_h1["n_injured"]) / len(harmed_bicycle_h1)
-diseased_per_accident_h1_motor_vehicle = sum(harmed_motor_vehicle_h1["n_diseased"]) / len(harmed_motor_vehicle_h1)
-diseased_per_accident_h1_bicycle = sum(harmed_bicycle_h1["n_diseased"]) / len(harmed_bicycle_h1)
+injured_per_accident_h1_motor_vehicle = per_accident["h1_motor_vehicle", "n_injured"]
+injured_per_accident_h1_bicycle = per_accident["h1_bicycle", "n_injured"]
+diseased_per_accident_h1_motor_vehicle = per_accident["h1_motor_vehicle", "n_diseased"]
+diseased_per_accident_h1_bicycle = per_accident["h1_bicycle", "n_diseased"]
 
-harmed_bicycle_h1_by_day = data_operations.aggregate_harm_by_day(harmed_bicycle_h1)
-harmed_motor_vehicle_h1_by_day = data_operations.aggregate_harm_by_day(harmed_motor_vehicle_h1)
+harmed_bicycle_h1_by_day = aggregate_harm_by_day(harmed_bicycle_h1)
+harmed_motor_vehicle_h1_by_day = aggregate_harm_by_day(harmed_motor_vehicle_h1)
 
-harmed_h1_joined = data_operations.join_by_day(
+harmed_h1_joined = join_by_day(
     df_bicycle=harmed_bicycle_h1_by_day,
     df_motor_vehicle=harmed_motor_vehicle_h1_by_day)
 
-harmed_h1 = data_operations.add_cumulative(harmed_h1_joined)
+harmed_h1 = add_cumulative(harmed_h1_joined)
 
 # Hypothesis 2: it's always the motor vehicle driver's fault
-harmed_bicycle_h2 = (
-    traffic_accidents
-    .assign(
-        # Summarize harm statistics
-        n_harmed=lambda df: (df["n_diseased"] + df["n_injured"]))
-    # Filter relevant accidents
-    .query("involves_cyclist & "
-           "not involves_motor_vehicle_driver")
-    )
+harmed_bicycle_h2 = scenarios.select(traffic_accidents, "h2", "bicycle", select_scenario)
+harmed_motor_vehicle_h2 = scenarios.select(traffic_accidents, "h2", "motor_vehicle", select_scenario)
 
-harmed_motor_vehicle_h2 = (
-    traffic_accidents
-    .assign(
-        # Summarize harm statistics
-        n_harmed=lambda df: (df["n_diseased"] + df["n_injured"]))
-    # Filter relevant accidents
-    .query("involves_motor_vehicle_driver & "
-           "not involves_truck_driver & "
-           "not involves_bus_driver & "
-           "(within_built_up_area | speed_limit <= 50)")
-    )
+injured_per_accident_h2_motor_vehicle = per_accident["h2_motor_vehicle", "n_injured"]
+injured_per_accident_h2_bicycle = per_accident["h2_bicycle", "n_injured"]
+diseased_per_accident_h2_motor_vehicle = per_accident["h2_motor_vehicle", "n_diseased"]
+diseased_per_accident_h2_bicycle = per_accident["h2_bicycle", "n_diseased"]
 
-injured_per_accident_h2_motor_vehicle = sum(harmed_motor_vehicle_h2["n_injured"]) / len(harmed_motor_vehicle_h2)
-injured_per_accident_h2_bicycle = sum(harmed_bicycle_h2["n_injured"]) / len(harmed_bicycle_h2)
-diseased_per_accident_h2_motor_vehicle = sum(harmed_motor_vehicle_h2["n_diseased"]) / len(harmed_motor_vehicle_h2)
-diseased_per_accident_h2_bicycle = sum(harmed_bicycle_h2["n_diseased"]) / len(harmed_bicycle_h2)
+harmed_bicycle_h2_by_day = aggregate_harm_by_day(harmed_bicycle_h2)
+harmed_motor_vehicle_h2_by_day = aggregate_harm_by_day(harmed_motor_vehicle_h2)
 
-harmed_bicycle_h2_by_day = data_operations.aggregate_harm_by_day(harmed_bicycle_h2)
-harmed_motor_vehicle_h2_by_day = data_operations.aggregate_harm_by_day(harmed_motor_vehicle_h2)
-
-harmed_h2_joined = data_operations.join_by_day(
+harmed_h2_joined = join_by_day(
     df_bicycle=harmed_bicycle_h2_by_day,
     df_motor_vehicle=harmed_motor_vehicle_h2_by_day)
 
-harmed_h2 = data_operations.add_cumulative(harmed_h2_joined)
+harmed_h2 = add_cumulative(harmed_h2_joined)
 
 
 ############################################################
 # Graph accidents where bicycle use if a valid alternative #
 ############################################################
 
-graphing.daily_results(
+h1_figure = graphing.daily_results(
     data=harmed_h1,
     motor_vehicle_title="deaths + injuries in <b>motor vehicle</b> accidents",
-    bicycle_title="deaths + injuries in <b>bicycle</b> accidents")
+    bicycle_title="deaths + injuries in <b>bicycle</b> accidents",
+    render_mode=DAILY_RESULTS_RENDER_MODE,
+    show=show_figures)
+report.add("Hypothesis 1: it's always the cyclist's fault", h1_figure)
 
-graphing.daily_results(
+h2_figure = graphing.daily_results(
     data=harmed_h2,
     motor_vehicle_title="deaths + injuries in <b>motor vehicle</b> accidents",
-    bicycle_title="deaths + injuries in <b>bicycle</b> accidents")
+    bicycle_title="deaths + injuries in <b>bicycle</b> accidents",
+    render_mode=DAILY_RESULTS_RENDER_MODE,
+    show=show_figures)
+report.add("Hypothesis 2: it's always the motor vehicle driver's fault", h2_figure)
+
+
+##############################
+# Normalise harm by exposure #
+##############################
+
+# Counter datasets are set in .env as JSON, by mode, e.g.:
+# EXPOSURE_DATASETS = {"bicycle": {"dataset_id": "...", "file_id": "...", "time_column": "...",
+#                      "count_column": "...", "station_column": "...", "delimiter": ";"}, "motor_vehicle": {...}}
+exposure_datasets = env_values.get("EXPOSURE_DATASETS", dict())
+
+exposures = dict()
+for exposure_mode, exposure_dataset in exposure_datasets.items():
+    counter_data = exposure.get_counter_data(
+        api=api,
+        dataset_id=exposure_dataset["dataset_id"],
+        file_id=exposure_dataset["file_id"],
+        delimiter=exposure_dataset.get("delimiter", ","))
+    station_column = exposure_dataset.get("station_column")
+    exposures[exposure_mode] = exposure.DailyExposure.from_counts(
+        times=pd.to_datetime(counter_data[exposure_dataset["time_column"]], format="mixed", dayfirst=True),
+        counts=counter_data[exposure_dataset["count_column"]],
+        stations=counter_data[station_column] if station_column else None)
+
+# Harm per million counted vehicles / cyclists
+exposure_ratios = dict()
+if {"motor_vehicle", "bicycle"} <= set(exposures):
+    for scenario_name, scenario_by_day in {"naive": naive, "victims": victims, "h1": harmed_h1, "h2": harmed_h2}.items():
+        scenario_rates = exposure.add_exposure_rates(scenario_by_day, exposures)
+        exposure_ratios[scenario_name] = exposure.exposure_ratio(scenario_rates)
+
+
+###########################################
+# Harm by time of day, weekday and season #
+###########################################
+
+scenario_frames = {
+    "naive": {
+        "motor_vehicle": scenarios.select(traffic_accidents, "naive", "motor_vehicle", select_scenario),
+        "bicycle": scenarios.select(traffic_accidents, "naive", "bicycle", select_scenario)},
+    "victims": {
+        "motor_vehicle": victims_motor_vehicle,
+        "bicycle": victims_bicycle},
+    "h1": {
+        "motor_vehicle": harmed_motor_vehicle_h1,
+        "bicycle": harmed_bicycle_h1},
+    "h2": {
+        "motor_vehicle": harmed_motor_vehicle_h2,
+        "bicycle": harmed_bicycle_h2}}
+
+harm_heatmaps = data_operations.aggregate_harm_heatmaps(
+    scenarios=scenario_frames,
+    period="season")
+
+for heatmap_scenario in harm_heatmaps["scenarios"]:
+    heatmap_figure = graphing.harm_heatmaps(
+        heatmaps=harm_heatmaps,
+        scenario=heatmap_scenario,
+        title=f"deaths + injuries by time of day and weekday ({heatmap_scenario})",
+        show=show_figures)
+    report.add(f"Harm by time of day and weekday ({heatmap_scenario})", heatmap_figure)
+
+
+###############################
+# Harm hotspots by grid cells #
+###############################
+
+# 2 km hexagons over the whole country for all scenarios
+harm_hotspots = data_operations.aggregate_harm_by_grid(
+    scenarios=scenario_frames,
+    cell_size=2000,
+    grid="hexagon")
+
+
+################
+# Write report #
+################
+
+report.write(path=report_path, incremental=True)
+
+
+result_cache.log_statistics()
@@ -0,0 +1,179 @@
+# standard
+import base64
+import hashlib
+import html
+import json
+import logging
+import os
+# external
+import numpy
+import plotly.graph_objects as go
+import plotly.offline
+import plotly.utils
+
+
+def encode_typed_array(values) -> (dict | None):
+    """
+    Encode numeric or datetime values as a plotly.js typed array spec.
+    Datetimes are encoded as milliseconds since epoch.
+    :param values: Array-like trace values
+    :return: {"dtype": ..., "bdata": ...} dict, or None if the values are not numeric or datetime
+    """
+    array = numpy.asarray(values)
+    if array.ndim == 0 or array.size == 0:
+        return None
+    if array.dtype.kind == "M":
+        array = array.astype("datetime64[ms]").astype("int64").astype("float64")
+    elif array.dtype.kind == "b":
+        array = array.astype("uint8")
+    elif array.dtype.kind in "iu":
+        # Plotly.js has no 64-bit integer typed arrays
+        array = array.astype("int32") if numpy.abs(array).max() < 2**31 else array.astype("float64")
+    elif array.dtype.kind != "f":
+        return None
+    array = numpy.ascontiguousarray(array)
+    spec = {
+        "dtype": array.dtype.str.lstrip("<|="),
+        "bdata": base64.b64encode(array.tobytes()).decode("ascii")}
+    if array.ndim > 1:
+        spec["shape"] = ",".join(str(length) for length in array.shape)
+    return spec
+
+
+def serialize_figure(figure: go.Figure) -> str:
+    """
+    Serialize a figure to JSON with trace coordinates as compact typed arrays.
+    :param figure: Plotly figure
+    :return: JSON string with "data" and "layout"
+    """
+    figure_json = figure.to_plotly_json()
+    date_axes = set()
+    for trace in figure_json["data"]:
+        for axis in ("x", "y", "z"):
+            if axis not in trace or isinstance(trace[axis], dict):
+                continue
+            is_date = numpy.asarray(trace[axis]).dtype.kind == "M"
+            spec = encode_typed_array(trace[axis])
+            if spec is None:
+                continue
+            trace[axis] = spec
+            if is_date and axis in ("x", "y"):
+                # Trace refers to its axis as e.g. "x2", layout calls it "xaxis2"
+                date_axes.add(trace.get(f"{axis}axis", axis).replace(axis, f"{axis}axis", 1))
+
+    # Numbers on an axis are only read as dates if the axis type says so
+    layout = figure_json["layout"]
+    for axis_name in date_axes:
+        layout.setdefault(axis_name, dict())["type"] = "date"
+
+    return json.dumps(figure_json, separators=(",", ":"), cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def write_atomically(path: str, text: str) -> None:
+    """
+    Write text to a file through a temporary file, so that readers never see a partly written file.
+    :param path: File path
+    :param text: File contents
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as temporary_file:
+        temporary_file.write(text)
+    os.replace(temporary_path, path)
+
+
+class Report:
+    """
+    Collection of figures that are written into a single self-contained HTML file.
+    Plotly.js is included only once and figure data is embedded as typed arrays.
+    """
+
+    def __init__(self, title: str):
+        self.title = title
+        self.figures = dict()
+
+    def add(self, name: str, figure: go.Figure) -> None:
+        """
+        Add figure to report. Figures are shown in the order they are added.
+        :param name: Unique figure name, also used as the figure heading
+        :param figure: Plotly figure
+        """
+        if name in self.figures:
+            logging.warning(f"Figure {name} is already in the report and will be replaced")
+        self.figures[name] = figure
+
+    def serialize(self) -> dict:
+        """
+        Serialize all figures.
+        :return: {figure name: JSON string}
+        """
+        return {name: serialize_figure(figure) for name, figure in self.figures.items()}
+
+    def to_html(self, serialized_figures: dict) -> str:
+        """
+        Build report HTML.
+        :param serialized_figures: Output of serialize
+        :return: HTML string
+        """
+        figure_sections = list()
+        for index, (name, figure_json) in enumerate(serialized_figures.items()):
+            # Prevent figure text from closing the script element
+            figure_json = figure_json.replace("</", "<\\/")
+            figure_sections.append(
+                f'<h2>{html.escape(name)}</h2>\n'
+                f'<div id="figure-{index}" class="figure"></div>\n'
+                f'<script type="application/json" id="figure-{index}-data">{figure_json}</script>\n')
+
+        report_html = (
+            '<!DOCTYPE html>\n'
+            '<html>\n<head>\n<meta charset="utf-8">\n'
+            f'<title>{html.escape(self.title)}</title>\n'
+            f'<script type="text/javascript">{plotly.offline.get_plotlyjs()}</script>\n'
+            '</head>\n<body>\n'
+            f'<h1>{html.escape(self.title)}</h1>\n'
+            f'{"".join(figure_sections)}'
+            '<script type="text/javascript">\n'
+            'document.querySelectorAll("div.figure").forEach(function (element) {\n'
+            '    var figure = JSON.parse(document.getElementById(element.id + "-data").textContent);\n'
+            '    Plotly.newPlot(element, figure.data, figure.layout, {responsive: true});\n'
+            '});\n'
+            '</script>\n'
+            '</body>\n</html>\n')
+        return report_html
+
+    def write(self, path: str, incremental: bool = False) -> list:
+        """
+        Write report to an HTML file.
+        On incremental runs, hashes of the serialized figures are kept in a <path>.manifest.json file
+        and the report is only rewritten if some figure changed since the previous run.
+        :param path: Output HTML file path
+        :param incremental: True/False - skip writing the report if no figure changed
+        :return: Names of figures that changed
+        """
+        serialized_figures = self.serialize()
+        changed_figures = list(serialized_figures)
+        manifest_path = f"{path}.manifest.json"
+        manifest = {
+            "title": self.title,
+            "figures": {name: hashlib.sha256(figure_json.encode("utf-8")).hexdigest()
+                        for name, figure_json in serialized_figures.items()}}
+
+        if incremental and os.path.exists(manifest_path) and os.path.exists(path):
+            try:
+                with open(manifest_path, encoding="utf-8") as manifest_file:
+                    previous_manifest = json.loads(manifest_file.read())
+            except (OSError, ValueError) as error:
+                logging.warning(f"Could not read report manifest {manifest_path}: {error}")
+                previous_manifest = dict()
+            previous_figures = previous_manifest.get("figures", dict())
+            changed_figures = [name for name, figure_hash in manifest["figures"].items()
+                               if previous_figures.get(name) != figure_hash]
+            # Figure order, removed figures and the title also change the report
+            if json.dumps(previous_manifest) == json.dumps(manifest):
+                logging.info(f"No figures changed, report {path} is up to date")
+                return changed_figures
+
+        # Report first, so that the manifest never describes a report that wasn't written
+        write_atomically(path, self.to_html(serialized_figures))
+        write_atomically(manifest_path, json.dumps(manifest, indent=2))
+        logging.info(f"Wrote report {path} ({len(changed_figures)}/{len(serialized_figures)} figures changed)")
+        return changed_figures
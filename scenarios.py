@@ -0,0 +1,66 @@
+# local
+import data_operations
+
+
+# Accident filters for each scenario and mode.
+# Queries can use n_harmed (deaths + injuries), see data_operations.select_scenario.
+SCENARIO_QUERIES = {
+    # All accidents involving the mode
+    "naive": {
+        "motor_vehicle": "involves_motor_vehicle_driver",
+        "bicycle": "involves_cyclist"},
+    # Accidents with harmed persons other than the causing driver
+    "victims": {
+        "motor_vehicle": "involves_motor_vehicle_driver & "
+                         "(n_harmed > 1 | involves_personal_light_electric_vehicle_driver | involves_pedestrian | "
+                         "involves_passenger | involves_motorcycle_driver | involves_moped_driver | involves_cyclist)",
+        "bicycle": "(involves_cyclist & not involves_motor_vehicle_driver) & "
+                   "(n_harmed > 1 | involves_personal_light_electric_vehicle_driver | involves_pedestrian)"},
+    # Hypothesis 1: it's always the cyclist's fault
+    "h1": {
+        "motor_vehicle": "involves_motor_vehicle_driver & "
+                         "not involves_truck_driver & "
+                         "not involves_bus_driver & "
+                         "not involves_cyclist &"
+                         "(within_built_up_area | speed_limit <= 50)",
+        "bicycle": "involves_cyclist"},
+    # Hypothesis 2: it's always the motor vehicle driver's fault
+    "h2": {
+        "motor_vehicle": "involves_motor_vehicle_driver & "
+                         "not involves_truck_driver & "
+                         "not involves_bus_driver & "
+                         "(within_built_up_area | speed_limit <= 50)",
+        "bicycle": "involves_cyclist & "
+                   "not involves_motor_vehicle_driver"}}
+
+# Scenarios that don't count the causing driver among the harmed
+VICTIM_SCENARIOS = ["victims"]
+
+
+def select(df, scenario: str, mode: str, select_scenario=data_operations.select_scenario):
+    """
+    Select accidents of a scenario and mode.
+    :param df: Cleaned traffic accidents data
+    :param scenario: Scenario name from SCENARIO_QUERIES
+    :param mode: "motor_vehicle" or "bicycle"
+    :param select_scenario: Function to select accidents by query (e.g. a memoized data_operations.select_scenario)
+    :return: Data frame of selected accidents with n_harmed column
+    """
+    selected = select_scenario(df, SCENARIO_QUERIES[scenario][mode])
+    if scenario in VICTIM_SCENARIOS:
+        selected = data_operations.count_victims(selected)
+    return selected
+
+
+def masks(df) -> dict:
+    """
+    Boolean masks of accidents in each scenario and mode, e.g. for data_operations.summarize_scenarios.
+    :param df: Cleaned traffic accidents data
+    :return: {"<scenario>_<mode>": boolean array aligned with df}
+    """
+    harmed = df.assign(n_harmed=df["n_diseased"] + df["n_injured"])
+    scenario_masks = dict()
+    for scenario, mode_queries in SCENARIO_QUERIES.items():
+        for mode, query in mode_queries.items():
+            scenario_masks[f"{scenario}_{mode}"] = harmed.eval(query).to_numpy(dtype=bool)
+    return scenario_masks
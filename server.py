@@ -0,0 +1,245 @@
+# standard
+import argparse
+import hashlib
+import http.server
+import json
+import logging
+import math
+import urllib.parse
+# external
+import numpy
+import pandas
+# local
+import caching
+import data_operations
+import scenarios
+
+
+class AnalyticsService:
+    """
+    Read-only queries on cleaned traffic accidents data.
+    Responses are cached by path and query parameters.
+    """
+
+    def __init__(self, data: pandas.DataFrame, cache_entries: int = 256):
+        self.data = data
+        self.response_cache = caching.ResultCache(max_entries=cache_entries)
+        self.get_response = self.response_cache.memoize(self.build_response)
+        self.endpoints = {
+            "/scenarios": self.get_scenarios,
+            "/series": self.get_series,
+            "/ratios": self.get_ratios,
+            "/sites": self.get_sites}
+
+    def build_response(self, path: str, query: tuple) -> (int, bytes, str):
+        """
+        Build JSON response for a request.
+        :param path: Request path, e.g. /series
+        :param query: Sorted tuple of (parameter, value) pairs
+        :return: HTTP status, response body and ETag
+        Missing or invalid parameters give status 400, other errors are raised, so that they are not cached.
+        """
+        endpoint = self.endpoints.get(path)
+        if endpoint is None:
+            status, content = 404, {"error": f"Unknown endpoint: {path}",
+                                    "endpoints": list(self.endpoints)}
+        else:
+            try:
+                status, content = 200, endpoint(dict(query))
+            except KeyError as error:
+                status, content = 400, {"error": f"Missing parameter: {error.args[0]}"}
+            except ValueError as error:
+                status, content = 400, {"error": str(error)}
+        body = json.dumps(content, separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        return status, body, etag
+
+    def warm_up(self) -> None:
+        """Precompute responses for the unfiltered scenario series and ratios."""
+        self.get_response("/ratios", tuple())
+        for scenario in scenarios.SCENARIO_QUERIES:
+            self.get_response("/series", (("scenario", scenario),))
+
+    def filter_accidents(self, params: dict) -> pandas.DataFrame:
+        """
+        Filter accidents by optional query parameters:
+        county, built_up (true/false), year_from, year_to, max_speed_limit.
+        :param params: Query parameters
+        :return: Filtered data frame
+        """
+        df = self.data
+        keep = numpy.ones(len(df), dtype=bool)
+        if "county" in params:
+            keep &= (df["county_name"] == params["county"]).to_numpy()
+        if "built_up" in params:
+            if params["built_up"].lower() not in ("true", "false"):
+                raise ValueError("built_up must be true or false")
+            keep &= (df["within_built_up_area"] == (params["built_up"].lower() == "true")).to_numpy()
+        if "year_from" in params:
+            keep &= (df["time"].dt.year >= int(params["year_from"])).to_numpy()
+        if "year_to" in params:
+            keep &= (df["time"].dt.year <= int(params["year_to"])).to_numpy()
+        if "max_speed_limit" in params:
+            keep &= (df["speed_limit"] <= float(params["max_speed_limit"])).to_numpy()
+        return df.loc[keep]
+
+    @staticmethod
+    def scenario_by_day(df: pandas.DataFrame, scenario: str) -> pandas.DataFrame:
+        if scenario not in scenarios.SCENARIO_QUERIES:
+            raise ValueError(f"Unknown scenario: {scenario}. Use one of: {', '.join(scenarios.SCENARIO_QUERIES)}")
+        harmed_by_day = {mode: data_operations.aggregate_harm_by_day(scenarios.select(df, scenario, mode))
+                         for mode in ["bicycle", "motor_vehicle"]}
+        if harmed_by_day["bicycle"].empty and harmed_by_day["motor_vehicle"].empty:
+            columns = ["day", "n_harmed_motor_vehicle", "n_harmed_bicycle",
+                       "n_harmed_motor_vehicle_cumulative", "n_harmed_bicycle_cumulative"]
+            return pandas.DataFrame(columns=columns).astype({"day": "datetime64[ns]"})
+        # join_by_day can't join empty frames, so a mode without accidents gets zero harm on the other mode's days
+        for mode, other_mode in [("bicycle", "motor_vehicle"), ("motor_vehicle", "bicycle")]:
+            if harmed_by_day[mode].empty:
+                harmed_by_day[mode] = harmed_by_day[other_mode].assign(n_harmed=0)
+        joined = data_operations.join_by_day(
+            df_bicycle=harmed_by_day["bicycle"],
+            df_motor_vehicle=harmed_by_day["motor_vehicle"])
+        return data_operations.add_cumulative(joined)
+
+    def get_scenarios(self, params: dict) -> dict:
+        return scenarios.SCENARIO_QUERIES
+
+    def get_series(self, params: dict) -> dict:
+        scenario_data = self.scenario_by_day(self.filter_accidents(params), params["scenario"])
+        series = {"scenario": params["scenario"],
+                  "day": scenario_data["day"].dt.strftime("%Y-%m-%d").tolist()}
+        for column in scenario_data.columns.drop("day"):
+            series[column] = scenario_data[column].tolist()
+        return series
+
+    def get_ratios(self, params: dict) -> dict:
+        df = self.filter_accidents(params)
+        ratios = dict()
+        for scenario in scenarios.SCENARIO_QUERIES:
+            n_harmed_motor_vehicle = float(scenarios.select(df, scenario, "motor_vehicle")["n_harmed"].sum())
+            n_harmed_bicycle = float(scenarios.select(df, scenario, "bicycle")["n_harmed"].sum())
+            ratio = n_harmed_motor_vehicle / n_harmed_bicycle if n_harmed_bicycle else None
+            ratios[scenario] = {
+                "n_harmed_motor_vehicle": n_harmed_motor_vehicle,
+                "n_harmed_bicycle": n_harmed_bicycle,
+                "motor_vehicle_bicycle_ratio": ratio}
+        return ratios
+
+    def get_sites(self, params: dict) -> dict:
+        """
+        Accidents at a site before and after a change (e.g. a barrier built), as in barrier_investigation.py.
+        The site is an L-EST97 box (x_min, x_max, y_min, y_max)
+        and/or a route segment (route_number or street_name, km_from, km_to).
+        """
+        df = self.filter_accidents(params)
+        change_time = pandas.Timestamp(params["change_date"])
+        if change_time.tzinfo is not None:
+            raise ValueError("change_date must be a local date or time without a time zone")
+
+        at_site = numpy.zeros(len(df), dtype=bool)
+        box_parameters = ["x_min", "x_max", "y_min", "y_max"]
+        if any(parameter in params for parameter in box_parameters):
+            x_min, x_max, y_min, y_max = (float(params[parameter]) for parameter in box_parameters)
+            at_site |= (df["gps_x"].between(x_min, x_max) & df["gps_y"].between(y_min, y_max)).to_numpy()
+        if "route_number" in params or "street_name" in params:
+            on_route = numpy.zeros(len(df), dtype=bool)
+            if "route_number" in params:
+                on_route |= (pandas.to_numeric(df["route_number"], errors="coerce")
+                             == float(params["route_number"])).to_numpy()
+            if "street_name" in params:
+                on_route |= (df["street_name"] == params["street_name"]).to_numpy()
+            km_marker = df["route_km_marker"]
+            on_segment = km_marker.between(float(params.get("km_from", 0)), float(params.get("km_to", math.inf)))
+            at_site |= on_route & on_segment.to_numpy()
+
+        site_accidents = df.loc[at_site].sort_values("time")
+        after_change = site_accidents["time"] > change_time
+        summary = dict()
+        for period, in_period in {"before": ~after_change, "after": after_change}.items():
+            period_accidents = site_accidents.loc[in_period]
+            summary[period] = {
+                "n_accidents": len(period_accidents),
+                "n_injured": int(period_accidents["n_injured"].sum()),
+                "n_diseased": int(period_accidents["n_diseased"].sum())}
+
+        accident_columns = ["time", "route_number", "route_km_marker", "n_participants", "n_vehicles",
+                            "n_diseased", "n_injured"]
+        accidents = site_accidents.loc[:, accident_columns].assign(
+            time=lambda table: table["time"].dt.strftime("%Y-%m-%d %H:%M"))
+        accidents = accidents.astype(object).where(accidents.notna(), None)
+        return {"change_date": change_time.strftime("%Y-%m-%d"),
+                **summary,
+                "accidents": accidents.to_dict(orient="records")}
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves AnalyticsService responses as JSON with ETags."""
+    # Keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+    cache_max_age = 300
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = tuple(sorted(urllib.parse.parse_qsl(url.query)))
+        try:
+            status, body, etag = self.server.service.get_response(url.path.rstrip("/") or "/", query)
+        except Exception:
+            # Unexpected errors are not cached, so the request is computed again next time
+            logging.exception(f"Could not handle request {self.path}")
+            status, body, etag = 500, b'{"error":"Internal server error"}', None
+
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", f"max-age={self.cache_max_age}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def run_server(data: pandas.DataFrame, host: str = "127.0.0.1", port: int = 8000) -> None:
+    """
+    Serve analytics endpoints until interrupted. Each request is handled in its own thread.
+    :param data: Cleaned traffic accidents data
+    :param host: Host to bind to
+    :param port: Port to listen on
+    """
+    server = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = AnalyticsService(data)
+    server.service.warm_up()
+    logging.info(f"Serving on http://{host}:{port} (endpoints: {', '.join(server.service.endpoints)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.service.response_cache.log_statistics()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Local read-only analytics service for traffic accidents data.")
+    parser.add_argument("--data", default="traffic_accidents.pickle",
+                        help="Cleaned data saved by main.py (CLEANED_DATA_PATH)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    arguments = parser.parse_args()
+
+    run_server(
+        data=pandas.read_pickle(arguments.data),
+        host=arguments.host,
+        port=arguments.port)